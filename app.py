@@ -1,12 +1,24 @@
+import os
+from contextlib import asynccontextmanager
+
+from anyio import CapacityLimiter, to_thread
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
-from detector import analyze_image_bytes
+from detector import analyze_image_stream, warm_up
 from fastapi.middleware.cors import CORSMiddleware
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # JIT-compile the detector kernels before accepting traffic.
+    warm_up()
+    yield
+
+
 app = FastAPI(
     title="Instamart AI Image Fraud Detector (Prototype)",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -17,15 +29,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Analysis is CPU-bound: run it off the event loop, at most one per core.
+# Kept separate from Starlette's default pool so upload I/O is never queued
+# behind it.
+analysis_limiter = CapacityLimiter(os.cpu_count() or 1)
+
 
 @app.post("/analyze")
 async def analyze_image(file: UploadFile = File(...)):
     if not file.content_type.startswith("image/"):
         raise HTTPException(400, "Upload an image file.")
 
-    image_bytes = await file.read()
-    if not image_bytes:
+    # Decode straight from the spooled upload instead of reading it into
+    # memory first.
+    fp = file.file
+    fp.seek(0, os.SEEK_END)
+    if fp.tell() == 0:
         raise HTTPException(400, "File is empty.")
+    fp.seek(0)
 
-    result = analyze_image_bytes(image_bytes)
+    result = await to_thread.run_sync(analyze_image_stream, fp, limiter=analysis_limiter)
     return JSONResponse(content=result)
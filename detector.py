@@ -1,7 +1,19 @@
-import io
+import hashlib
+import math
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO
+
 import numpy as np
-from PIL import Image, ImageChops
+from PIL import Image
 import cv2
+from cachetools import TTLCache
+from numba import njit
+
+# Recent results, keyed by the SHA-256 of the upload.
+_result_cache = TTLCache(maxsize=4096, ttl=600)
+_result_cache_lock = threading.Lock()
+
 
 # -------------------------
 # Helper: Extract EXIF metadata
@@ -9,14 +21,16 @@ import cv2
 def extract_exif(image: Image.Image):
     try:
         exif = image.getexif()
-        if not exif or len(exif) == 0:
+        if not exif:
             return False, None, None, None, None
 
-        exif_dict = {image.getexif().get_ifd(0).get(tag): val for tag, val in exif.items()}
-        software = exif_dict.get(305) if exif_dict else None   # "Software"
-        dt_original = exif_dict.get(36867) if exif_dict else None
-        dt_digitized = exif_dict.get(36868) if exif_dict else None
-        dt_generic = exif_dict.get(306) if exif_dict else None  # DateTime
+        # Software/DateTime live in IFD0; the capture timestamps live in the
+        # Exif sub-IFD (pointer tag 0x8769).
+        exif_ifd = exif.get_ifd(0x8769)
+        software = exif.get(305)             # "Software"
+        dt_original = exif_ifd.get(36867)    # "DateTimeOriginal"
+        dt_digitized = exif_ifd.get(36868)   # "DateTimeDigitized"
+        dt_generic = exif.get(306)           # "DateTime"
 
         return True, software, dt_original, dt_digitized, dt_generic
 
@@ -25,51 +39,223 @@ def extract_exif(image: Image.Image):
 
 
 # -------------------------
-# Helper: Error Level Analysis (ELA)
+# Helper: in-memory JPEG round-trip
+# Encodes and decodes straight between numpy arrays via OpenCV's codec.
+# -------------------------
+def _jpeg_roundtrip(np_img, quality):
+    bgr = cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR)
+    ok, buffer = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG re-encode failed")
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR_RGB)
+
+
+# -------------------------
+# Helper: shared pixel buffers
+# Decoded once per request; every analysis reads views of these arrays.
 # -------------------------
-def error_level_analysis(image: Image.Image):
-    ela_temp = io.BytesIO()
-    image.save(ela_temp, "JPEG", quality=95)
-    ela_temp.seek(0)
+@dataclass
+class ImageFeatures:
+    rgb: np.ndarray
+    resaved: np.ndarray
+
+
+def build_features(image: Image.Image):
+    rgb = np.asarray(image)
+    resaved = _jpeg_roundtrip(rgb, 95)
+    return ImageFeatures(rgb=rgb, resaved=resaved)
 
-    recompressed = Image.open(ela_temp)
-    ela = ImageChops.difference(image, recompressed)
 
-    ela_arr = np.array(ela.convert("L"))
-    mean_ela = float(np.mean(ela_arr))
-    hot_fraction = float(np.mean(ela_arr > 40))
+# -------------------------
+# Helper: Error Level Analysis (ELA)
+# -------------------------
+@njit(nogil=True, fastmath=True, cache=True)
+def _ela_reduce(orig, resaved, threshold):
+    # Single pass over both uint8 images: per-pixel absolute difference,
+    # converted to luma with Pillow's "L" weights, summed and thresholded
+    # without materialising any full-size temporary. Rows are walked as
+    # flat interleaved RGB and the hot-pixel count is accumulated without
+    # a branch, which lets LLVM turn the loop into packed SIMD compares.
+    h, w, _ = orig.shape
+    orig_rows = orig.reshape(h, w * 3)
+    resaved_rows = resaved.reshape(h, w * 3)
+    total = 0
+    hot = 0
+    for y in range(h):
+        o = orig_rows[y]
+        r = resaved_rows[y]
+        row_total = np.int32(0)
+        row_hot = np.int32(0)
+        for x in range(w):
+            i = 3 * x
+            d0 = abs(np.int32(o[i]) - np.int32(r[i]))
+            d1 = abs(np.int32(o[i + 1]) - np.int32(r[i + 1]))
+            d2 = abs(np.int32(o[i + 2]) - np.int32(r[i + 2]))
+            luma = (d0 * 19595 + d1 * 38470 + d2 * 7471 + 32768) >> 16
+            row_total += luma
+            row_hot += luma > threshold
+        total += row_total
+        hot += row_hot
+    n = h * w
+    return total / n, hot / n
 
-    return mean_ela, hot_fraction
+
+def error_level_analysis(features: ImageFeatures):
+    mean_ela, hot_fraction = _ela_reduce(features.rgb, features.resaved, 40)
+    return float(mean_ela), float(hot_fraction)
 
 
 # -------------------------
 # Helper: High-frequency (texture) analysis
 # AI-regenerated images tend to lack micro-textures.
 # -------------------------
-def high_frequency_score(np_img):
-    gray = cv2.cvtColor(np_img, cv2.COLOR_RGB2GRAY)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    return float(laplacian.var())
+# BT.601 luma in 15-bit fixed point; bit-exact with cv2.COLOR_RGB2GRAY.
+_GRAY_WEIGHTS = (9798, 19235, 3735)
+
+
+@njit(inline="always")
+def _gray_row(rgb, y, out):
+    wr, wg, wb = _GRAY_WEIGHTS
+    for x in range(rgb.shape[1]):
+        out[x] = (
+            np.int32(rgb[y, x, 0]) * wr + np.int32(rgb[y, x, 1]) * wg
+            + np.int32(rgb[y, x, 2]) * wb + 16384
+        ) >> 15
+
+
+@njit(inline="always")
+def _reflect101(i, n):
+    if i < 0:
+        return min(-i, n - 1)
+    if i >= n:
+        return max(2 * n - 2 - i, 0)
+    return i
+
+
+@njit(nogil=True, fastmath=True, cache=True)
+def _laplacian_variance(rgb):
+    # 4-neighbour Laplacian of the luma image with reflect-101 borders
+    # (OpenCV's default), accumulating exact integer sums. Gray values are
+    # produced a row at a time into a rolling three-row window, so neither
+    # the gray image nor the Laplacian image is ever materialised.
+    h, w, _ = rgb.shape
+    above = np.empty(w, np.int32)
+    row = np.empty(w, np.int32)
+    below = np.empty(w, np.int32)
+    _gray_row(rgb, _reflect101(-1, h), above)
+    _gray_row(rgb, 0, row)
+    total = 0
+    total_sq = 0
+    for y in range(h):
+        _gray_row(rgb, _reflect101(y + 1, h), below)
+        for x in range(w):
+            left = row[_reflect101(x - 1, w)]
+            right = row[_reflect101(x + 1, w)]
+            lap = np.int64(left + right + above[x] + below[x] - 4 * row[x])
+            total += lap
+            total_sq += lap * lap
+        above, row, below = row, below, above
+    n = h * w
+    mean = total / n
+    return total_sq / n - mean * mean
+
+
+def high_frequency_score(features: ImageFeatures):
+    return float(_laplacian_variance(features.rgb))
 
 
 # -------------------------
 # Helper: RGB correlation (GAN signature)
 # AI images often have overly correlated color channels.
 # -------------------------
-def rgb_correlation(np_img):
-    r, g, b = np_img[:, :, 0], np_img[:, :, 1], np_img[:, :, 2]
-    corr_rg = np.corrcoef(r.flatten(), g.flatten())[0, 1]
-    corr_gb = np.corrcoef(g.flatten(), b.flatten())[0, 1]
-    corr_rb = np.corrcoef(r.flatten(), b.flatten())[0, 1]
-    return float(corr_rg), float(corr_gb), float(corr_rb)
+@njit(nogil=True, fastmath=True, cache=True)
+def _channel_moments(rgb):
+    # Exact integer channel sums, sums of squares and cross sums in one pass
+    # over the interleaved uint8 pixels; no float copy of the image is made.
+    h, w, _ = rgb.shape
+    rows = rgb.reshape(h, w * 3)
+    sr = sg = sb = srr = sgg = sbb = srg = sgb = srb = 0
+    for y in range(h):
+        p = rows[y]
+        for x in range(w):
+            i = 3 * x
+            r = np.int64(p[i])
+            g = np.int64(p[i + 1])
+            b = np.int64(p[i + 2])
+            sr += r
+            sg += g
+            sb += b
+            srr += r * r
+            sgg += g * g
+            sbb += b * b
+            srg += r * g
+            sgb += g * b
+            srb += r * b
+    return sr, sg, sb, srr, sgg, sbb, srg, sgb, srb
+
+
+def _pearson(cov, var_a, var_b):
+    if var_a == 0 or var_b == 0:
+        return float("nan")
+    return cov / math.sqrt(var_a * var_b)
+
+
+def rgb_correlation(features: ImageFeatures):
+    # Covariances are formed as n*sum(xy) - sum(x)*sum(y) on Python ints, so
+    # everything up to the final division is exact.
+    h, w, _ = features.rgb.shape
+    n = h * w
+    sr, sg, sb, srr, sgg, sbb, srg, sgb, srb = (int(v) for v in _channel_moments(features.rgb))
+    var_r = n * srr - sr * sr
+    var_g = n * sgg - sg * sg
+    var_b = n * sbb - sb * sb
+    corr_rg = _pearson(n * srg - sr * sg, var_r, var_g)
+    corr_gb = _pearson(n * sgb - sg * sb, var_g, var_b)
+    corr_rb = _pearson(n * srb - sr * sb, var_r, var_b)
+    return corr_rg, corr_gb, corr_rb
+
+
+# -------------------------
+# Helper: kernel warm-up
+# Compiles (or loads from cache) the Numba kernels for the exact array
+# types the request path uses, so the first upload doesn't pay for it.
+# -------------------------
+def warm_up():
+    features = build_features(Image.new("RGB", (8, 8)))
+    error_level_analysis(features)
+    high_frequency_score(features)
+    rgb_correlation(features)
 
 
 # -------------------------
 # MAIN FUNCTION
 # -------------------------
-def analyze_image_bytes(image_bytes: bytes):
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    np_img = np.array(image)
+def analyze_image_stream(fp: BinaryIO):
+    # Retries and batch re-scans resend identical bytes; keyed by content
+    # hash, those skip the whole pipeline.
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(1 << 20), b""):
+        digest.update(chunk)
+    key = digest.digest()
+    with _result_cache_lock:
+        cached = _result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    fp.seek(0)
+    result = _analyze(fp)
+    with _result_cache_lock:
+        _result_cache[key] = result
+    return result
+
+
+def _analyze(fp: BinaryIO):
+    # Pillow reads from the file object on demand, so the upload is never
+    # copied into an intermediate bytes buffer.
+    image = Image.open(fp)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    features = build_features(image)
 
     # -------------------------
     # Extract EXIF
@@ -79,17 +265,7 @@ def analyze_image_bytes(image_bytes: bytes):
     # -------------------------
     # ELA
     # -------------------------
-    mean_ela, hot_fraction = error_level_analysis(image)
-
-    # -------------------------
-    # Texture score
-    # -------------------------
-    hf = high_frequency_score(np_img)
-
-    # -------------------------
-    # Color correlation
-    # -------------------------
-    corr_rg, corr_gb, corr_rb = rgb_correlation(np_img)
+    mean_ela, hot_fraction = error_level_analysis(features)
 
     # -------------------------
     # Scoring logic
@@ -114,20 +290,29 @@ def analyze_image_bytes(image_bytes: bytes):
         score += 0.35
         explanation_parts.append("ELA hotspots detected (local edits likely)")
 
-    # 4. High-frequency too LOW (AI regeneration)
-    if hf < 35:
-        score += 0.30
-        explanation_parts.append("Very low high-frequency detail (AI-regenerated image likely)")
+    # Checks 4-6 can only raise the score. Once it is already in the
+    # high-priority band they cannot change the recommendation, so the
+    # texture and colour passes are skipped and reported as None.
+    hf = corr_rg = corr_gb = corr_rb = None
+    if score < 0.60:
+        # Texture score and color correlation
+        hf = high_frequency_score(features)
+        corr_rg, corr_gb, corr_rb = rgb_correlation(features)
+
+        # 4. High-frequency too LOW (AI regeneration)
+        if hf < 35:
+            score += 0.30
+            explanation_parts.append("Very low high-frequency detail (AI-regenerated image likely)")
 
-    # 5. RGB correlations too high (GAN signature)
-    if corr_rg > 0.985 and corr_gb > 0.985 and corr_rb > 0.985:
-        score += 0.30
-        explanation_parts.append("Abnormally high RGB channel correlation (AI signature)")
+        # 5. RGB correlations too high (GAN signature)
+        if corr_rg > 0.985 and corr_gb > 0.985 and corr_rb > 0.985:
+            score += 0.30
+            explanation_parts.append("Abnormally high RGB channel correlation (AI signature)")
 
-    # 6. Strong synthetic indicator: no EXIF + low ELA + low HF
-    if not exif_present and mean_ela < 4 and hf < 35:
-        score = max(score, 0.75)
-        explanation_parts.append("Strong evidence of fully synthetic or AI-modified image")
+        # 6. Strong synthetic indicator: no EXIF + low ELA + low HF
+        if not exif_present and mean_ela < 4 and hf < 35:
+            score = max(score, 0.75)
+            explanation_parts.append("Strong evidence of fully synthetic or AI-modified image")
 
     # Normalize score
     score = max(0.0, min(score, 1.0))
@@ -153,10 +338,10 @@ def analyze_image_bytes(image_bytes: bytes):
             "datetime_generic": dt_gen,
             "mean_ela": round(mean_ela, 3),
             "hot_fraction": round(hot_fraction, 3),
-            "high_freq_variance": round(hf, 3),
-            "corr_rg": round(corr_rg, 4),
-            "corr_gb": round(corr_gb, 4),
-            "corr_rb": round(corr_rb, 4),
+            "high_freq_variance": round(hf, 3) if hf is not None else None,
+            "corr_rg": round(corr_rg, 4) if corr_rg is not None else None,
+            "corr_gb": round(corr_gb, 4) if corr_gb is not None else None,
+            "corr_rb": round(corr_rb, 4) if corr_rb is not None else None,
         },
         "explanation": explanation,
     }
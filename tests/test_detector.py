@@ -0,0 +1,170 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageChops
+
+import detector
+from detector import (
+    ImageFeatures,
+    _ela_reduce,
+    _gray_row,
+    _laplacian_variance,
+    analyze_image_stream,
+    build_features,
+    error_level_analysis,
+    rgb_correlation,
+)
+
+KERNEL_SHAPES = [(1, 1), (1, 7), (7, 1), (3, 5), (65, 129), (1000, 1024)]
+
+
+def _random_rgb(shape, seed):
+    return np.random.default_rng(seed).integers(0, 256, shape + (3,), dtype=np.uint8)
+
+
+def _jpeg(pixels, **kwargs):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90, **kwargs)
+    return buffer.getvalue()
+
+
+def _photo(width, height, sigma=8, seed=0):
+    # Smooth gradients plus sensor-like noise, passed through a q90 JPEG
+    # round-trip so the frame carries camera-style compression history.
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([(x * 0.05) % 256, (y * 0.07) % 256, ((x + y) * 0.03) % 256], -1)
+    pixels = np.clip(base + rng.normal(0, sigma, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return np.array(Image.open(buffer))
+
+
+def _png(pixels, **kwargs):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG", **kwargs)
+    return buffer.getvalue()
+
+
+def test_large_upload_edit_outside_centre_is_detected():
+    # A never-compressed patch spliced into the top-left corner of a 12MP
+    # photo must be found: every pixel of the frame is analysed.
+    pixels = _photo(4000, 3000)
+    rng = np.random.default_rng(1)
+    pixels[:800, :1200] = rng.integers(0, 256, (800, 1200, 3), dtype=np.uint8)
+    data = _png(pixels)
+
+    full_ela, full_hot = error_level_analysis(build_features(Image.open(io.BytesIO(data)).convert("RGB")))
+    result = analyze_image_stream(io.BytesIO(data))
+
+    assert result["signals"]["hot_fraction"] == round(full_hot, 3)
+    assert full_hot > 0.02
+    assert "ELA hotspots detected" in result["explanation"]
+    assert result["recommendation"] == "high_priority_manual_review"
+
+
+def test_exif_software_and_timestamps_are_read():
+    exif = Image.Exif()
+    exif[305] = "Adobe Photoshop 25.0"
+    exif[306] = "2024:01:01 10:00:00"
+    capture = exif.get_ifd(0x8769)
+    capture[36867] = "2023:12:31 09:00:00"
+    capture[36868] = "2023:12:31 09:00:01"
+
+    result = analyze_image_stream(io.BytesIO(_jpeg(_photo(320, 240), exif=exif)))
+    signals = result["signals"]
+
+    assert signals["exif_present"] is True
+    assert signals["software_tag"] == "Adobe Photoshop 25.0"
+    assert signals["datetime_original"] == "2023:12:31 09:00:00"
+    assert signals["datetime_digitized"] == "2023:12:31 09:00:01"
+    assert signals["datetime_generic"] == "2024:01:01 10:00:00"
+    assert result["tampering_score"] == 0.3
+    assert "Software tag indicates editing: Adobe Photoshop 25.0" in result["explanation"]
+
+
+@pytest.mark.parametrize("shape", KERNEL_SHAPES)
+def test_ela_reduce_matches_pillow_difference(shape):
+    orig = _random_rgb(shape, 0)
+    resaved = _random_rgb(shape, 1)
+
+    ela = np.asarray(ImageChops.difference(Image.fromarray(orig), Image.fromarray(resaved)).convert("L"))
+    mean_ela, hot_fraction = _ela_reduce(orig, resaved, 40)
+
+    assert mean_ela == pytest.approx(ela.mean(), rel=1e-12)
+    assert hot_fraction == pytest.approx((ela > 40).mean(), rel=1e-12)
+
+
+@pytest.mark.parametrize("shape", KERNEL_SHAPES)
+def test_laplacian_variance_matches_opencv(shape):
+    rgb = _random_rgb(shape, 2)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+    expected = cv2.Laplacian(gray, cv2.CV_64F).var()
+
+    assert _laplacian_variance(rgb) == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_gray_row_matches_opencv_for_every_colour():
+    # All 2**24 RGB triples, laid out as a 4096x4096 image.
+    rgb = np.arange(1 << 24, dtype=np.uint32).view(np.uint8).reshape(4096, 4096, 4)[..., :3]
+    rgb = np.ascontiguousarray(rgb)
+    expected = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+    row = np.empty(4096, np.int32)
+    for y in range(4096):
+        _gray_row(rgb, y, row)
+        np.testing.assert_array_equal(row, expected[y])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("shape", KERNEL_SHAPES)
+def test_rgb_correlation_matches_numpy(shape):
+    rgb = _random_rgb(shape, 3)
+    # Correlate the channels so the coefficients are not all near zero.
+    rgb[..., 1] = rgb[..., 0] // 2 + rgb[..., 1] // 2
+    r, g, b = (rgb[..., c].ravel() for c in range(3))
+
+    expected = [np.corrcoef(r, g)[0, 1], np.corrcoef(g, b)[0, 1], np.corrcoef(r, b)[0, 1]]
+    actual = rgb_correlation(ImageFeatures(rgb=rgb, resaved=rgb))
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12, equal_nan=True)
+
+
+def test_texture_and_colour_skipped_once_high_priority():
+    # No EXIF (+0.25) and a never-compressed frame lighting up ELA (+0.35)
+    # already reach the high-priority band.
+    result = analyze_image_stream(io.BytesIO(_png(_random_rgb((240, 320), 4))))
+    signals = result["signals"]
+
+    assert result["tampering_score"] == 0.6
+    assert result["recommendation"] == "high_priority_manual_review"
+    assert signals["hot_fraction"] > 0.02
+    for name in ("high_freq_variance", "corr_rg", "corr_gb", "corr_rb"):
+        assert signals[name] is None
+
+
+def test_texture_and_colour_run_below_high_priority():
+    # EXIF present, ELA hotspots only: 0.35 keeps the remaining checks live.
+    exif = Image.Exif()
+    exif[306] = "2024:01:01 10:00:00"
+    result = analyze_image_stream(io.BytesIO(_png(_random_rgb((240, 320), 4), exif=exif)))
+    signals = result["signals"]
+
+    assert result["tampering_score"] == 0.35
+    assert result["recommendation"] == "low_priority_manual_review"
+    for name in ("high_freq_variance", "corr_rg", "corr_gb", "corr_rb"):
+        assert signals[name] is not None
+
+
+def test_identical_upload_is_served_from_cache(monkeypatch):
+    data = _jpeg(_photo(320, 240, seed=5))
+    first = analyze_image_stream(io.BytesIO(data))
+
+    def fail(fp):
+        raise AssertionError("cached upload was analysed again")
+
+    monkeypatch.setattr(detector, "_analyze", fail)
+    assert analyze_image_stream(io.BytesIO(data)) is first